@@ -9,10 +9,10 @@ simulates packet drops, and handles retransmissions.
 """
 
 import socket
+import struct
 import time
-import random
 import logging
-import threading
+import selectors
 import matplotlib.pyplot as plt
 import numpy as np
 
@@ -23,11 +23,69 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Wire format: 1-byte message tag and uint32 count, followed by count
+# little-endian uint32 sequence numbers
+TAG_SEQ = 1
+TAG_ACK = 2
+HEADER_FORMAT = '<BI'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+def expand_batch_timestamps(batches):
+    """
+    Expand per-batch (timestamp, packet count) records into one timestamp per packet.
+    
+    Args:
+        batches (list): (timestamp, packet count) tuples in recording order
+    
+    Returns:
+        np.ndarray: Timestamp of every recorded packet
+    """
+    if not batches:
+        return np.empty(0)
+    timestamps, counts = zip(*batches)
+    return np.repeat(timestamps, counts)
+
+class SequenceHistory:
+    """Sequence number history backed by a preallocated NumPy array."""
+    
+    def __init__(self, capacity):
+        """
+        Initialize the history.
+        
+        Args:
+            capacity (int): Number of sequence numbers to preallocate room for
+        """
+        self.values = np.empty(max(capacity, 1), dtype=np.uint32)
+        self.size = 0
+    
+    def __len__(self):
+        return self.size
+    
+    def extend(self, seq_nums):
+        """
+        Append sequence numbers, doubling the backing array when it is full.
+        
+        Args:
+            seq_nums (list or np.ndarray): Sequence numbers to append
+        """
+        count = len(seq_nums)
+        if self.size + count > len(self.values):
+            grown = np.empty(max(2 * len(self.values), self.size + count), dtype=np.uint32)
+            grown[:self.size] = self.values[:self.size]
+            self.values = grown
+        self.values[self.size:self.size + count] = seq_nums
+        self.size += count
+    
+    def to_array(self):
+        """Return the recorded sequence numbers as an array view."""
+        return self.values[:self.size]
+
 class TCPClient:
     """TCP Client implementation with sliding window protocol simulation."""
     
     def __init__(self, server_host='127.0.0.1', server_port=12345, 
-                 window_size=10, max_seq_num=2**16, drop_rate=0.01):
+                 window_size=10, max_seq_num=2**16, drop_rate=0.01, seed=None,
+                 send_buffer_size=4 * 1024 * 1024, recv_buffer_size=4 * 1024 * 1024, tcp_nodelay=True):
         """
         Initialize the TCP client.
         
@@ -37,41 +95,60 @@ class TCPClient:
             window_size (int): Initial sliding window size
             max_seq_num (int): Maximum sequence number (2^16 as per requirements)
             drop_rate (float): Probability of packet drop (0.01 = 1%)
+            seed (int): Seed for the packet drop simulation (None for a random seed)
+            send_buffer_size (int): Socket send buffer size (SO_SNDBUF) in bytes
+            recv_buffer_size (int): Socket receive buffer size (SO_RCVBUF) in bytes
+            tcp_nodelay (bool): Disable Nagle's algorithm on the connection
         """
         self.server_host = server_host
         self.server_port = server_port
         self.window_size = window_size
         self.max_seq_num = max_seq_num
         self.drop_rate = drop_rate
+        self.rng = np.random.default_rng(seed)
+        self.send_buffer_size = send_buffer_size
+        self.recv_buffer_size = recv_buffer_size
+        self.tcp_nodelay = tcp_nodelay
         self.client_socket = None
+        self.selector = None
+        self.selector_events = 0  # Events the socket is currently registered for
+        self.send_buffer = bytearray()  # Encoded messages not yet written to the socket
+        self.recv_buffer = bytearray(65536)  # Preallocated buffer for received bytes
+        self.recv_length = 0  # Bytes in recv_buffer not yet parsed into messages
         
         # For sliding window protocol
         self.base = 0  # First sequence number in the window
         self.next_seq_num = 0  # Next sequence number to be sent
-        self.window = {}  # Map of sequence numbers to their status (sent, acked)
+        self.window_sent = np.zeros(max_seq_num, dtype=np.bool_)  # Sequence numbers sent
+        self.window_acked = np.zeros(max_seq_num, dtype=np.bool_)  # Sequence numbers ACKed
         
         # For tracking packets
         self.sent_packets = 0
         self.acked_packets = 0
-        self.dropped_packets = set()
-        self.retransmission_queue = set()
+        self.dropped_count = 0
+        self.to_retransmit = np.zeros(max_seq_num, dtype=np.bool_)  # Dropped packets awaiting retransmission
         
         # For visualization
         self.start_time = None
         self.window_size_history = []
         self.window_size_timestamps = []
-        self.seq_sent_history = []
-        self.seq_sent_timestamps = []
-        self.seq_dropped_history = []
-        self.seq_dropped_timestamps = []
+        self.seq_sent_history = SequenceHistory(max_seq_num)
+        self.seq_sent_batches = []  # (timestamp, packet count) per send
+        self.seq_dropped_history = SequenceHistory(int(max_seq_num * drop_rate) + 1)
+        self.seq_dropped_batches = []  # (timestamp, packet count) per drop batch
         
         # For retransmission statistics
-        self.retransmission_counts = {}  # seq_num -> count of retransmissions
+        self.retransmission_counts = np.zeros(max_seq_num, dtype=np.uint8)  # seq_num -> count of retransmissions
         
     def connect(self):
         """Connect to the TCP server."""
         try:
             self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # Buffer sizes must be set before connect() to affect the negotiated TCP window
+            self.client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer_size)
+            self.client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.recv_buffer_size)
+            if self.tcp_nodelay:
+                self.client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             self.client_socket.connect((self.server_host, self.server_port))
             logger.info(f"Connected to server at {self.server_host}:{self.server_port}")
             
@@ -104,61 +181,62 @@ class TCPClient:
         if not self.connect():
             return
         
-        self.start_time = time.time()
+        self.start_time = time.monotonic()
         
         try:
-            # Start a thread to receive ACKs
-            ack_thread = threading.Thread(target=self.receive_acks)
-            ack_thread.daemon = True
-            ack_thread.start()
+            # Sends and ACKs are both driven by one non-blocking selector loop
+            self.client_socket.setblocking(False)
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(self.client_socket, selectors.EVENT_READ)
+            self.selector_events = selectors.EVENT_READ
             
-            # Start sending packets
-            while self.sent_packets < total_packets:
+            # Send packets until every one is ACKed, or the final ACKs time out
+            timeout = None
+            while self.acked_packets < total_packets:
+                if self.sent_packets >= total_packets:
+                    if timeout is None:
+                        timeout = time.monotonic() + 30  # 30 seconds timeout
+                    elif time.monotonic() >= timeout:
+                        break
+                
                 # Process any pending retransmissions first
                 self.process_retransmissions()
                 
                 # Send new packets if window allows
-                while (self.next_seq_num < self.base + self.window_size and 
-                       self.next_seq_num < total_packets and 
-                       self.next_seq_num < self.max_seq_num):
-                    
-                    # Simulate packet drop
-                    if random.random() < self.drop_rate:
-                        logger.debug(f"Dropping packet with sequence number {self.next_seq_num}")
-                        self.dropped_packets.add(self.next_seq_num)
-                        self.retransmission_queue.add(self.next_seq_num)
-                        
-                        # Record for visualization
-                        self.seq_dropped_history.append(self.next_seq_num)
-                        self.seq_dropped_timestamps.append(time.time() - self.start_time)
-                        
-                        # Update retransmission count
-                        if self.next_seq_num not in self.retransmission_counts:
-                            self.retransmission_counts[self.next_seq_num] = 0
-                    else:
-                        # Send the packet (sequence number)
-                        self.send_packet(self.next_seq_num)
-                    
-                    # Update window and counters
-                    self.window[self.next_seq_num] = {'sent': True, 'acked': False}
-                    self.next_seq_num += 1
-                    self.sent_packets += 1
-                    
-                    # Record window size for visualization
-                    self.window_size_history.append(self.window_size)
-                    self.window_size_timestamps.append(time.time() - self.start_time)
+                first_seq = self.next_seq_num
+                window_end = max(min(self.base + self.window_size, total_packets, self.max_seq_num), first_seq)
+                seq_nums = np.arange(first_seq, window_end)
                 
-                # Retransmit dropped packets after every 100 sequence numbers
-                if self.next_seq_num % 100 == 0 and self.retransmission_queue:
-                    self.process_retransmissions()
+                # Simulate packet drops for the whole window fill at once
+                drop_mask = self.rng.random(len(seq_nums)) < self.drop_rate
+                batch = seq_nums[~drop_mask]
+                dropped = seq_nums[drop_mask]
                 
-                # Small delay to prevent CPU overload
-                time.sleep(0.001)
-            
-            # Wait for all ACKs or timeout
-            timeout = time.time() + 30  # 30 seconds timeout
-            while self.acked_packets < total_packets and time.time() < timeout:
-                time.sleep(0.1)
+                if len(dropped):
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("Dropping packets with sequence numbers %s", dropped.tolist())
+                    self.dropped_count += len(dropped)
+                    self.to_retransmit[dropped] = True
+                
+                # Update window and counters
+                self.window_sent[first_seq:window_end] = True
+                self.next_seq_num = window_end
+                self.sent_packets += len(seq_nums)
+                
+                # Send the whole window fill at once
+                self.send_packets(batch)
+                
+                # Record dropped packets and window size for visualization, once per window fill
+                if len(seq_nums):
+                    now = time.monotonic() - self.start_time
+                    self.record_dropped(dropped, now)
+                    self.window_size_history.append(self.window_size)
+                    self.window_size_timestamps.append(now)
+                
+                # Wait for the socket; don't block while dropped retransmissions are still queued
+                if not self.poll_socket(0 if self.has_pending_retransmissions() else 1.0):
+                    logger.info("Server closed the connection")
+                    break
             
             logger.info(f"Transmission completed. Sent: {self.sent_packets}, ACKed: {self.acked_packets}")
             
@@ -168,74 +246,157 @@ class TCPClient:
         except Exception as e:
             logger.error(f"Error during transmission: {e}")
         finally:
+            if self.selector:
+                self.selector.close()
             if self.client_socket:
                 self.client_socket.close()
             logger.info("Client shutdown")
     
-    def send_packet(self, seq_num):
+    def send_packets(self, seq_nums):
         """
-        Send a packet (sequence number) to the server.
+        Queue a batch of packets (sequence numbers) to be sent to the server in one message.
         
         Args:
-            seq_num (int): Sequence number to send
+            seq_nums (list or np.ndarray): Sequence numbers to send
         """
-        try:
-            message = f"SEQ:{seq_num}"
-            self.client_socket.send(message.encode('utf-8'))
-            logger.debug(f"Sent packet with sequence number {seq_num}")
-            
-            # Record for visualization
-            self.seq_sent_history.append(seq_num)
-            self.seq_sent_timestamps.append(time.time() - self.start_time)
+        if len(seq_nums) == 0:
+            return
+        
+        payload = np.asarray(seq_nums, dtype='<u4')
+        self.send_buffer += struct.pack(HEADER_FORMAT, TAG_SEQ, len(payload))
+        self.send_buffer += payload.tobytes()
+        logger.debug("Queued %d packets starting at sequence number %d", len(seq_nums), seq_nums[0])
+        
+        # Record for visualization
+        self.seq_sent_history.extend(seq_nums)
+        self.seq_sent_batches.append((time.monotonic() - self.start_time, len(seq_nums)))
+    
+    def record_dropped(self, seq_nums, timestamp):
+        """
+        Record a batch of dropped packets for visualization.
+        
+        Args:
+            seq_nums (list or np.ndarray): Sequence numbers dropped
+            timestamp (float): Seconds since start at which the batch was dropped
+        """
+        if len(seq_nums):
+            self.seq_dropped_history.extend(seq_nums)
+            self.seq_dropped_batches.append((timestamp, len(seq_nums)))
+    
+    def poll_socket(self, timeout):
+        """
+        Wait for the socket to become ready, then write queued messages and read ACKs.
+        
+        Args:
+            timeout (float): Maximum seconds to wait (0 to poll without blocking)
+        
+        Returns:
+            bool: False if the server closed the connection, True otherwise
+        """
+        # Write right away: the socket is nearly always writable, so waiting for
+        # EVENT_WRITE first would only add a select() round trip per message
+        self.flush_send_buffer()
+        
+        # Only re-register (an extra syscall) when the events of interest change
+        events = selectors.EVENT_READ
+        if self.send_buffer:
+            events |= selectors.EVENT_WRITE
+        if events != self.selector_events:
+            self.selector.modify(self.client_socket, events)
+            self.selector_events = events
+        
+        for _, mask in self.selector.select(timeout):
+            if mask & selectors.EVENT_WRITE:
+                self.flush_send_buffer()
             
-        except Exception as e:
-            logger.error(f"Error sending packet: {e}")
+            if mask & selectors.EVENT_READ and not self.receive_acks():
+                return False
+        
+        return True
     
-    def receive_acks(self):
-        """Receive and process ACKs from the server."""
+    def flush_send_buffer(self):
+        """Write as much of the send buffer as the socket accepts without blocking."""
+        if not self.send_buffer:
+            return
+        
         try:
-            buffer_size = 1024
-            while True:
-                data = self.client_socket.recv(buffer_size)
-                if not data:
-                    break
-                
-                # Process the received ACKs
-                self.process_acks(data)
-                
-        except Exception as e:
-            logger.error(f"Error receiving ACKs: {e}")
+            sent = self.client_socket.send(self.send_buffer)
+            del self.send_buffer[:sent]
+        except BlockingIOError:
+            pass
     
-    def process_acks(self, data):
+    def receive_acks(self):
+        """
+        Read everything available on the socket and process the ACKs it contains.
+        
+        Returns:
+            bool: False if the server closed the connection, True otherwise
+        """
+        while True:
+            if self.recv_length == len(self.recv_buffer):
+                # Make room by consuming complete messages, or grow for an oversized one
+                self.process_received_data()
+                if self.recv_length == len(self.recv_buffer):
+                    self.recv_buffer.extend(bytes(len(self.recv_buffer)))
+            
+            try:
+                received = self.client_socket.recv_into(memoryview(self.recv_buffer)[self.recv_length:])
+            except BlockingIOError:
+                break
+            if received == 0:
+                return False
+            self.recv_length += received
+        
+        self.process_received_data()
+        return True
+    
+    def process_received_data(self):
+        """Parse and process every complete message in the receive buffer."""
+        offset = 0
+        while self.recv_length - offset >= HEADER_SIZE:
+            tag, count = struct.unpack_from(HEADER_FORMAT, self.recv_buffer, offset)
+            end = offset + HEADER_SIZE + count * 4
+            if self.recv_length < end:
+                break
+            
+            # Process the received ACKs
+            if tag == TAG_ACK:
+                self.process_acks(np.frombuffer(self.recv_buffer, dtype='<u4', count=count,
+                                                offset=offset + HEADER_SIZE))
+            offset = end
+        
+        # Move any partial message to the front of the buffer for the next read
+        remaining = self.recv_length - offset
+        self.recv_buffer[:remaining] = self.recv_buffer[offset:self.recv_length]
+        self.recv_length = remaining
+    
+    def process_acks(self, ack_numbers):
         """
         Process ACKs received from the server.
         
         Args:
-            data (bytes): Data received from server containing ACKs
+            ack_numbers (np.ndarray): Sequence numbers ACKed by the server
         """
         try:
-            data_str = data.decode('utf-8')
-            if data_str.startswith("ACK:"):
-                ack_numbers_str = data_str[4:].strip()
-                ack_numbers = [int(num) for num in ack_numbers_str.split(',') if num]
-                
-                # Process each ACK
-                for ack_num in ack_numbers:
-                    if ack_num in self.window and not self.window[ack_num]['acked']:
-                        self.window[ack_num]['acked'] = True
-                        self.acked_packets += 1
-                        
-                        # Remove from retransmission queue if present
-                        if ack_num in self.retransmission_queue:
-                            self.retransmission_queue.remove(ack_num)
-                
-                # Slide the window
-                self.slide_window()
-                
-                # Log progress periodically
-                if self.acked_packets % 1000 == 0:
-                    logger.info(f"Packets sent: {self.sent_packets}, ACKed: {self.acked_packets}, "
-                                f"Window size: {self.window_size}")
+            previously_acked = self.acked_packets
+            ack_numbers = np.unique(ack_numbers[ack_numbers < self.max_seq_num])
+            
+            # Mark newly ACKed packets in the window
+            mask = self.window_sent[ack_numbers] & ~self.window_acked[ack_numbers]
+            newly_acked = ack_numbers[mask]
+            self.window_acked[newly_acked] = True
+            self.acked_packets += int(mask.sum())
+            
+            # Remove from retransmission queue if present
+            self.to_retransmit[newly_acked] = False
+            
+            # Slide the window
+            self.slide_window()
+            
+            # Log progress periodically (after every 100,000 packets)
+            if self.acked_packets // 100_000 > previously_acked // 100_000:
+                logger.info("Packets sent: %d, ACKed: %d, Window size: %d",
+                            self.sent_packets, self.acked_packets, self.window_size)
         
         except Exception as e:
             logger.error(f"Error processing ACKs: {e}")
@@ -243,48 +404,50 @@ class TCPClient:
     def slide_window(self):
         """Slide the window based on received ACKs."""
         # Find the new base (first unacked packet)
-        while self.base in self.window and self.window[self.base]['acked']:
-            self.base += 1
+        tail = self.window_acked[self.base:self.next_seq_num]
+        all_acked = tail.all()
+        if all_acked:
+            self.base = self.next_seq_num
+        else:
+            self.base += int(np.argmin(tail))
         
         # Adjust window size (simple congestion control)
         # Increase window size if all packets in current window are ACKed
-        all_acked = all(self.window.get(seq_num, {}).get('acked', False) 
-                        for seq_num in range(self.base, self.next_seq_num))
-        
         if all_acked:
             self.window_size = min(self.window_size + 1, 100)  # Cap at 100 for simplicity
         
         # Record window size for visualization
         self.window_size_history.append(self.window_size)
-        self.window_size_timestamps.append(time.time() - self.start_time)
+        self.window_size_timestamps.append(time.monotonic() - self.start_time)
+    
+    def has_pending_retransmissions(self):
+        """Return True if any dropped packet is still waiting to be retransmitted."""
+        return bool(self.to_retransmit[self.base:self.next_seq_num].any())
     
     def process_retransmissions(self):
         """Process and retransmit dropped packets."""
-        retransmitted = set()
+        # Only unACKed packets can be pending, and those all lie inside the window
+        pending = np.flatnonzero(self.to_retransmit[self.base:self.next_seq_num]) + self.base
+        if len(pending) == 0:
+            return
         
-        for seq_num in self.retransmission_queue:
-            # Simulate packet drop for retransmissions too
-            if random.random() < self.drop_rate:
-                logger.debug(f"Dropping retransmission of sequence number {seq_num}")
-                
-                # Record for visualization
-                self.seq_dropped_history.append(seq_num)
-                self.seq_dropped_timestamps.append(time.time() - self.start_time)
-            else:
-                # Retransmit the packet
-                self.send_packet(seq_num)
-                logger.debug(f"Retransmitted packet with sequence number {seq_num}")
-                
-                # Update retransmission count
-                if seq_num in self.retransmission_counts:
-                    self.retransmission_counts[seq_num] += 1
-                else:
-                    self.retransmission_counts[seq_num] = 1
-                
-                retransmitted.add(seq_num)
+        # Simulate packet drop for retransmissions too
+        drop_mask = self.rng.random(len(pending)) < self.drop_rate
+        retransmitted = pending[~drop_mask]
+        dropped = pending[drop_mask]
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Retransmitting packets with sequence numbers %s, dropping %s",
+                         retransmitted.tolist(), dropped.tolist())
+        
+        # Retransmit the packets in one message
+        self.send_packets(retransmitted)
+        self.record_dropped(dropped, time.monotonic() - self.start_time)
+        
+        # Update retransmission count
+        np.add.at(self.retransmission_counts, retransmitted, 1)
         
         # Remove successfully retransmitted packets from the queue
-        self.retransmission_queue -= retransmitted
+        self.to_retransmit[retransmitted] = False
     
     def generate_visualizations(self):
         """Generate visualizations and save statistics."""
@@ -301,7 +464,9 @@ class TCPClient:
             
             # 2. TCP Sequence numbers sent over time
             plt.figure(figsize=(12, 6))
-            plt.scatter(self.seq_sent_timestamps, self.seq_sent_history, s=1, alpha=0.5)
+            # Bin the points instead of drawing each one, which does not scale to millions of packets
+            plt.hexbin(expand_batch_timestamps(self.seq_sent_batches), self.seq_sent_history.to_array(),
+                       gridsize=200, bins='log', mincnt=1)
             plt.title('TCP Sequence Numbers Sent Over Time')
             plt.xlabel('Time (seconds)')
             plt.ylabel('Sequence Number')
@@ -311,7 +476,8 @@ class TCPClient:
             
             # 3. TCP Sequence numbers dropped over time
             plt.figure(figsize=(12, 6))
-            plt.scatter(self.seq_dropped_timestamps, self.seq_dropped_history, s=1, alpha=0.5, color='red')
+            plt.hexbin(expand_batch_timestamps(self.seq_dropped_batches), self.seq_dropped_history.to_array(),
+                       gridsize=200, bins='log', mincnt=1, cmap='Reds')
             plt.title('TCP Sequence Numbers Dropped Over Time')
             plt.xlabel('Time (seconds)')
             plt.ylabel('Sequence Number')
@@ -320,18 +486,14 @@ class TCPClient:
             plt.close()
             
             # Save retransmission statistics
-            retrans_stats = {}
-            for seq_num, count in self.retransmission_counts.items():
-                if count in retrans_stats:
-                    retrans_stats[count] += 1
-                else:
-                    retrans_stats[count] = 1
+            retrans_counts, num_packets = np.unique(
+                self.retransmission_counts[self.retransmission_counts > 0], return_counts=True)
             
             with open('client_retransmission_stats.txt', 'w') as f:
                 f.write("# of retransmissions | # of packets\n")
                 f.write("-" * 40 + "\n")
-                for retrans_count in sorted(retrans_stats.keys()):
-                    f.write(f"{retrans_count} | {retrans_stats[retrans_count]}\n")
+                for retrans_count, count in zip(retrans_counts.tolist(), num_packets.tolist()):
+                    f.write(f"{retrans_count} | {count}\n")
             
             # Save overall statistics
             with open('client_stats.txt', 'w') as f:
@@ -339,7 +501,7 @@ class TCPClient:
                 f.write(f"Server IP Address: {self.server_host}\n")
                 f.write(f"Total Packets Sent: {self.sent_packets}\n")
                 f.write(f"Total Packets ACKed: {self.acked_packets}\n")
-                f.write(f"Packets Dropped: {len(self.dropped_packets)}\n")
+                f.write(f"Packets Dropped: {self.dropped_count}\n")
                 f.write(f"Drop Rate: {self.drop_rate}\n")
             
             logger.info("Visualizations and statistics generated successfully")
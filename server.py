@@ -9,10 +9,10 @@ tracks missing packets, and calculates goodput.
 """
 
 import socket
+import struct
 import time
 import threading
 import logging
-from collections import defaultdict
 import matplotlib.pyplot as plt
 import numpy as np
 
@@ -23,10 +23,68 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Wire format: 1-byte message tag and uint32 count, followed by count
+# little-endian uint32 sequence numbers
+TAG_SEQ = 1
+TAG_ACK = 2
+HEADER_FORMAT = '<BI'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+def expand_batch_timestamps(batches):
+    """
+    Expand per-batch (timestamp, packet count) records into one timestamp per packet.
+    
+    Args:
+        batches (list): (timestamp, packet count) tuples in recording order
+    
+    Returns:
+        np.ndarray: Timestamp of every recorded packet
+    """
+    if not batches:
+        return np.empty(0)
+    timestamps, counts = zip(*batches)
+    return np.repeat(timestamps, counts)
+
+class SequenceHistory:
+    """Sequence number history backed by a preallocated NumPy array."""
+    
+    def __init__(self, capacity):
+        """
+        Initialize the history.
+        
+        Args:
+            capacity (int): Number of sequence numbers to preallocate room for
+        """
+        self.values = np.empty(max(capacity, 1), dtype=np.uint32)
+        self.size = 0
+    
+    def __len__(self):
+        return self.size
+    
+    def extend(self, seq_nums):
+        """
+        Append sequence numbers, doubling the backing array when it is full.
+        
+        Args:
+            seq_nums (list or np.ndarray): Sequence numbers to append
+        """
+        count = len(seq_nums)
+        if self.size + count > len(self.values):
+            grown = np.empty(max(2 * len(self.values), self.size + count), dtype=np.uint32)
+            grown[:self.size] = self.values[:self.size]
+            self.values = grown
+        self.values[self.size:self.size + count] = seq_nums
+        self.size += count
+    
+    def to_array(self):
+        """Return the recorded sequence numbers as an array view."""
+        return self.values[:self.size]
+
 class TCPServer:
     """TCP Server implementation with sliding window protocol simulation."""
     
-    def __init__(self, host='0.0.0.0', port=12345, max_seq_num=2**16):
+    def __init__(self, host='0.0.0.0', port=12345, max_seq_num=2**16, ack_batch_size=4096,
+                 send_buffer_size=4 * 1024 * 1024, recv_buffer_size=4 * 1024 * 1024, tcp_nodelay=True):
         """
         Initialize the TCP server.
         
@@ -34,16 +92,30 @@ class TCPServer:
             host (str): Host IP address to bind to
             port (int): Port number to listen on
             max_seq_num (int): Maximum sequence number (2^16 as per requirements)
+            ack_batch_size (int): Number of pending ACKs that forces an immediate flush
+            send_buffer_size (int): Socket send buffer size (SO_SNDBUF) in bytes
+            recv_buffer_size (int): Socket receive buffer size (SO_RCVBUF) in bytes
+            tcp_nodelay (bool): Disable Nagle's algorithm on the client connection
         """
         self.host = host
         self.port = port
         self.max_seq_num = max_seq_num
+        self.send_buffer_size = send_buffer_size
+        self.recv_buffer_size = recv_buffer_size
+        self.tcp_nodelay = tcp_nodelay
         self.server_socket = None
         self.client_address = None
+        self.recv_buffer = bytearray(65536)  # Preallocated buffer for received bytes
+        self.recv_length = 0  # Bytes in recv_buffer not yet parsed into messages
+        self.ack_batch_size = ack_batch_size
+        self.pending_acks = []  # ACK payloads waiting to be sent in one message
+        self.pending_ack_count = 0
         
         # Data structures for tracking packets
-        self.received_packets = set()
-        self.missing_packets = set()
+        self.received = np.zeros(max_seq_num, dtype=np.bool_)  # Sequence numbers received
+        self.missing = np.zeros(max_seq_num, dtype=np.bool_)  # Sequence numbers still missing
+        self.missing_count = 0
+        self.lowest_missing = 0  # No missing sequence number below this one
         self.total_received = 0
         self.total_expected = 0
         self.highest_seq_received = -1
@@ -56,20 +128,22 @@ class TCPServer:
         # For visualization
         self.window_size_history = []
         self.window_size_timestamps = []
-        self.seq_received_history = []
-        self.seq_received_timestamps = []
-        self.seq_dropped_history = []
-        self.seq_dropped_timestamps = []
+        self.seq_received_history = SequenceHistory(max_seq_num)  # Each packet is received once
+        self.seq_received_batches = []  # (timestamp, packet count) per received batch
+        self.seq_dropped_history = SequenceHistory(max_seq_num)  # Each packet is marked missing once
+        self.seq_dropped_batches = []  # (timestamp, packet count) per detected gap batch
         
         # For retransmission statistics
-        self.retransmission_stats = defaultdict(int)
-        self.packet_retransmission_count = defaultdict(int)
+        self.retrans_count = np.zeros(max_seq_num, dtype=np.uint8)  # seq_num -> count of retransmissions
         
     def start(self):
         """Start the TCP server and listen for connections."""
         try:
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            # Larger kernel buffers, set before listen() so accepted sockets inherit them
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.recv_buffer_size)
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer_size)
             self.server_socket.bind((self.host, self.port))
             self.server_socket.listen(1)
             
@@ -81,7 +155,7 @@ class TCPServer:
             logger.info(f"Connection established with {self.client_address}")
             
             # Start time for measurements
-            self.start_time = time.time()
+            self.start_time = time.monotonic()
             
             # Handle client connection in a separate thread
             client_thread = threading.Thread(target=self.handle_client, args=(client_socket,))
@@ -115,16 +189,22 @@ class TCPServer:
             
             # Send connection setup success message
             client_socket.send("Connection setup success".encode('utf-8'))
+            if self.tcp_nodelay:
+                client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             
             # Process sequence numbers from client
-            buffer_size = 1024
             while True:
-                data = client_socket.recv(buffer_size)
-                if not data:
+                if self.recv_length == len(self.recv_buffer):
+                    # A single message is larger than the buffer
+                    self.recv_buffer.extend(bytes(len(self.recv_buffer)))
+                
+                received = client_socket.recv_into(memoryview(self.recv_buffer)[self.recv_length:])
+                if received == 0:
                     break
+                self.recv_length += received
                 
-                # Process the received sequence numbers
-                self.process_sequence_numbers(data, client_socket)
+                # Process every complete message received so far
+                self.process_received_data(client_socket)
                 
                 # Check if we've reached the target number of packets
                 if self.total_expected >= 10_000_000:
@@ -138,80 +218,119 @@ class TCPServer:
         finally:
             client_socket.close()
     
-    def process_sequence_numbers(self, data, client_socket):
+    def process_received_data(self, client_socket):
+        """
+        Parse and process every complete message in the receive buffer.
+        
+        Messages may arrive split across or coalesced within recv calls, so any
+        trailing partial message is kept for the next read.
+        
+        Args:
+            client_socket (socket): Socket connected to the client
+        """
+        offset = 0
+        while self.recv_length - offset >= HEADER_SIZE:
+            tag, count = struct.unpack_from(HEADER_FORMAT, self.recv_buffer, offset)
+            end = offset + HEADER_SIZE + count * 4
+            if self.recv_length < end:
+                break
+            
+            # Process the received sequence numbers
+            if tag == TAG_SEQ:
+                seq_numbers = np.frombuffer(self.recv_buffer, dtype='<u4', count=count,
+                                            offset=offset + HEADER_SIZE)
+                self.process_sequence_numbers(seq_numbers, client_socket)
+            offset = end
+        
+        # Move any partial message to the front of the buffer for the next read
+        remaining = self.recv_length - offset
+        self.recv_buffer[:remaining] = self.recv_buffer[offset:self.recv_length]
+        self.recv_length = remaining
+        
+        # ACK everything from this read before blocking on the next one
+        self.flush_acks(client_socket)
+    
+    def flush_acks(self, client_socket):
+        """
+        Send all queued ACKs to the client as a single message.
+        
+        Args:
+            client_socket (socket): Socket connected to the client
+        """
+        if not self.pending_acks:
+            return
+        
+        header = struct.pack(HEADER_FORMAT, TAG_ACK, self.pending_ack_count)
+        client_socket.sendall(header + b"".join(self.pending_acks))
+        self.pending_acks = []
+        self.pending_ack_count = 0
+    
+    def process_sequence_numbers(self, seq_numbers, client_socket):
         """
         Process sequence numbers received from client.
         
         Args:
-            data (bytes): Data received from client containing sequence numbers
+            seq_numbers (np.ndarray): Sequence numbers received from client
             client_socket (socket): Socket connected to the client
         """
-        # Parse sequence numbers from data
-        # Format: "SEQ:number1,number2,..."
         try:
-            data_str = data.decode('utf-8')
-            if data_str.startswith("SEQ:"):
-                seq_numbers_str = data_str[4:].strip()
-                seq_numbers = [int(num) for num in seq_numbers_str.split(',') if num]
-                
-                # Process each sequence number
-                for seq_num in seq_numbers:
-                    self.total_expected += 1
-                    
-                    # Update highest sequence received
-                    if seq_num > self.highest_seq_received:
-                        self.highest_seq_received = seq_num
-                    
-                    # Check if this is a new packet or retransmission
-                    if seq_num in self.missing_packets:
-                        self.missing_packets.remove(seq_num)
-                        self.received_packets.add(seq_num)
-                        self.total_received += 1
-                        
-                        # Update retransmission statistics
-                        self.packet_retransmission_count[seq_num] += 1
-                        retrans_count = self.packet_retransmission_count[seq_num]
-                        self.retransmission_stats[retrans_count] += 1
-                        
-                        # Record for visualization
-                        self.seq_received_history.append(seq_num)
-                        self.seq_received_timestamps.append(time.time() - self.start_time)
-                    elif seq_num not in self.received_packets:
-                        self.received_packets.add(seq_num)
-                        self.total_received += 1
-                        
-                        # Record for visualization
-                        self.seq_received_history.append(seq_num)
-                        self.seq_received_timestamps.append(time.time() - self.start_time)
-                
-                # Check for missing packets in the sequence
-                for seq_num in range(0, self.highest_seq_received + 1):
-                    if seq_num not in self.received_packets and seq_num not in self.missing_packets:
-                        self.missing_packets.add(seq_num)
-                        
-                        # Record for visualization
-                        self.seq_dropped_history.append(seq_num)
-                        self.seq_dropped_timestamps.append(time.time() - self.start_time)
-                
-                # Calculate and record window size (estimate based on highest seq - lowest missing)
-                if self.missing_packets:
-                    window_size = self.highest_seq_received - min(self.missing_packets)
-                else:
-                    window_size = self.highest_seq_received
-                
-                self.window_size_history.append(window_size)
-                self.window_size_timestamps.append(time.time() - self.start_time)
+            previously_received = self.total_received
+            now = time.monotonic() - self.start_time
+            
+            # Classify the batch: new packets, and retransmissions of packets seen as missing
+            new_seqs = seq_numbers[~self.received[seq_numbers]]
+            retransmitted = seq_numbers[self.missing[seq_numbers]]
+            self.total_expected += len(seq_numbers)
+            self.total_received += len(new_seqs)
+            self.received[new_seqs] = True
+            self.missing[retransmitted] = False
+            self.missing_count -= len(retransmitted)
+            
+            # Update retransmission statistics
+            np.add.at(self.retrans_count, retransmitted, 1)
+            
+            # Record for visualization
+            self.seq_received_history.extend(new_seqs)
+            self.seq_received_batches.append((now, len(new_seqs)))
+            
+            # Check for missing packets between the previous and the new highest sequence number
+            highest = int(seq_numbers.max()) if len(seq_numbers) else -1
+            if highest > self.highest_seq_received:
+                low = self.highest_seq_received + 1
+                gaps = np.flatnonzero(~self.received[low:highest + 1]) + low
+                self.missing[gaps] = True
+                self.missing_count += len(gaps)
+                self.highest_seq_received = highest
                 
-                # Calculate goodput periodically (after every 1000 packets)
-                if self.total_received % 1000 == 0:
-                    goodput = self.total_received / self.total_expected
-                    self.goodput_values.append(goodput)
-                    self.goodput_timestamps.append(time.time() - self.start_time)
-                    logger.info(f"Packets received: {self.total_received}, Goodput: {goodput:.4f}")
+                # Record for visualization
+                self.seq_dropped_history.extend(gaps)
+                self.seq_dropped_batches.append((now, len(gaps)))
+            
+            # Calculate and record window size (estimate based on highest seq - lowest missing)
+            if self.missing_count:
+                self.lowest_missing += int(np.argmax(self.missing[self.lowest_missing:self.highest_seq_received + 1]))
+                window_size = self.highest_seq_received - self.lowest_missing
+            else:
+                window_size = self.highest_seq_received
+            
+            self.window_size_history.append(window_size)
+            self.window_size_timestamps.append(now)
+            
+            # Calculate goodput periodically (after every 1000 packets)
+            if self.total_received // 1000 > previously_received // 1000:
+                goodput = self.total_received / self.total_expected
+                self.goodput_values.append(goodput)
+                self.goodput_timestamps.append(now)
                 
-                # Send ACK for the received sequence numbers
-                ack_message = f"ACK:{','.join(str(seq_num) for seq_num in seq_numbers)}"
-                client_socket.send(ack_message.encode('utf-8'))
+                # Log progress less often (after every 100,000 packets)
+                if self.total_received // 100_000 > previously_received // 100_000:
+                    logger.info("Packets received: %d, Goodput: %.4f", self.total_received, goodput)
+            
+            # Queue ACK for the received sequence numbers
+            self.pending_acks.append(seq_numbers.tobytes())
+            self.pending_ack_count += len(seq_numbers)
+            if self.pending_ack_count >= self.ack_batch_size:
+                self.flush_acks(client_socket)
         
         except Exception as e:
             logger.error(f"Error processing sequence numbers: {e}")
@@ -231,7 +350,9 @@ class TCPServer:
             
             # 2. TCP Sequence number received over time
             plt.figure(figsize=(12, 6))
-            plt.scatter(self.seq_received_timestamps, self.seq_received_history, s=1, alpha=0.5)
+            # Bin the points instead of drawing each one, which does not scale to millions of packets
+            plt.hexbin(expand_batch_timestamps(self.seq_received_batches), self.seq_received_history.to_array(),
+                       gridsize=200, bins='log', mincnt=1)
             plt.title('TCP Sequence Numbers Received Over Time')
             plt.xlabel('Time (seconds)')
             plt.ylabel('Sequence Number')
@@ -241,7 +362,8 @@ class TCPServer:
             
             # 3. TCP Sequence number dropped over time
             plt.figure(figsize=(12, 6))
-            plt.scatter(self.seq_dropped_timestamps, self.seq_dropped_history, s=1, alpha=0.5, color='red')
+            plt.hexbin(expand_batch_timestamps(self.seq_dropped_batches), self.seq_dropped_history.to_array(),
+                       gridsize=200, bins='log', mincnt=1, cmap='Reds')
             plt.title('TCP Sequence Numbers Dropped Over Time')
             plt.xlabel('Time (seconds)')
             plt.ylabel('Sequence Number')
@@ -260,11 +382,12 @@ class TCPServer:
             plt.close()
             
             # Save retransmission statistics to a file
+            retrans_counts, num_packets = np.unique(self.retrans_count[self.retrans_count > 0], return_counts=True)
             with open('retransmission_stats.txt', 'w') as f:
                 f.write("# of retransmissions | # of packets\n")
                 f.write("-" * 40 + "\n")
-                for retrans_count in sorted(self.retransmission_stats.keys()):
-                    f.write(f"{retrans_count} | {self.retransmission_stats[retrans_count]}\n")
+                for retrans_count, count in zip(retrans_counts.tolist(), num_packets.tolist()):
+                    f.write(f"{retrans_count} | {count}\n")
             
             # Save overall statistics
             with open('server_stats.txt', 'w') as f:
@@ -272,7 +395,7 @@ class TCPServer:
                 f.write(f"Client IP Address: {self.client_address[0] if self.client_address else 'N/A'}\n")
                 f.write(f"Total Packets Expected: {self.total_expected}\n")
                 f.write(f"Total Packets Received: {self.total_received}\n")
-                f.write(f"Missing Packets: {len(self.missing_packets)}\n")
+                f.write(f"Missing Packets: {self.missing_count}\n")
                 f.write(f"Average Goodput: {sum(self.goodput_values)/len(self.goodput_values) if self.goodput_values else 0:.4f}\n")
             
             logger.info("Visualizations and statistics generated successfully")